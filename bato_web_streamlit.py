@@ -11,16 +11,39 @@ Features:
 
 import streamlit as st
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup, SoupStrainer
 import re
+import ast
 import os
 import shutil
 import json
+import hashlib
+import functools
 from PIL import Image
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 import tempfile
+import threading
 import time
 import zipfile
+from urllib.parse import urlparse
+
+try:
+    import img2pdf
+except ImportError:
+    img2pdf = None
+
+try:
+    import pyvips
+except Exception:  # Module missing or libvips not found
+    pyvips = None
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+    TURBO_JPEG = TurboJPEG()
+except Exception:  # Module missing or libturbojpeg not found
+    TURBO_JPEG = None
 
 # ============ CONFIGURATION ============
 st.set_page_config(
@@ -40,6 +63,29 @@ BATO_DOMAINS = [
     "jto.to", "lto.to", "mto.to", "nto.to", "vto.to", "wto.to",
     "bato.ac", "bato.bz", "bato.to", "comiko.net", "mangatoto.com"
 ]
+BATO_DOMAIN_SET = frozenset(BATO_DOMAINS)
+
+@st.cache_resource
+def get_session():
+    """One HTTP session for the whole server, so it survives Streamlit reruns"""
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    adapter = HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=32,
+        # Retry gateway errors only - retrying timeouts would multiply every
+        # request's timeout and stall the mirror race on a dead host
+        max_retries=Retry(total=2, connect=0, read=0, backoff_factor=0.3, 
+                          status_forcelist=[502, 503, 504])
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+# Shared HTTP session - keep-alive connections are reused across all page and
+# image requests (and every rerun) instead of paying a TCP+TLS handshake per image.
+# pool_maxsize must stay >= the download ThreadPoolExecutor's max_workers.
+SESSION = get_session()
 
 STITCH_PRESETS = {
     'skip': {'height': 0, 'name': '🚀 Skip', 'desc': '1 image = 1 page. Fastest!'},
@@ -49,39 +95,96 @@ STITCH_PRESETS = {
     'custom': {'height': None, 'name': '⚙️ Custom', 'desc': 'Set your own!'}
 }
 
+# On-disk image cache so re-downloading a chapter (e.g. after changing the
+# stitch mode) copies local files instead of refetching every image
+IMAGE_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'bato_cache')
+IMAGE_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# Minimum seconds between progress repaints - each one is a websocket message
+PROGRESS_INTERVAL = 0.2
+
+IMAGE_EXTS = frozenset({'png', 'jpg', 'jpeg', 'webp', 'gif'})
+
+# Leading bytes of each format we save, so pages keep their real extension
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', '.jpg'),
+    (b'\x89PNG', '.png'),
+    (b'GIF8', '.gif'),
+)
+
+# Tags get_chapter_info reads the chapter title from
+CHAPTER_TITLE_TAGS = SoupStrainer(['h3', 'h1', 'title'])
+
+# Precompiled patterns (used per image / per script tag)
+UNSAFE_CHARS_RE = re.compile(r'[<>:"/\\|?*]')
+WHITESPACE_RE = re.compile(r'\s+')
+DIGITS_RE = re.compile(r'(\d+)')
+REWRITE_RE = re.compile(r'^(https://k).*\.(png|jpg|jpeg|webp)(\?.*)?$', re.I)
+CHAPTER_HREF_RE = re.compile(r'/chapter/\d+')
+CHAPTER_NUM_RE = re.compile(r'(?:Chapter|Ch\.?)\s*(\d+(?:\.\d+)?)', re.I)
+CHAPTER_URL_NUM_RE = re.compile(r'/chapter/(\d+)')
+PAGE_FILE_RE = re.compile(r'page_\d{4}\.\w+')
+SCRIPT_RE = re.compile(r'<script[^>]*>(.*?)</script>', re.S | re.I)
+IMG_HTTPS_RE = re.compile(r'imgHttps\s*=\s*(\[[^\]]*\])')
+# Longest extension first, and never followed by a letter or digit so '.jpg'
+# can't match inside '.jpeg' or the middle of a word
+QUOTED_IMG_URL_RE = re.compile(r'"(https://[^"]+\.(?:jpeg|jpg|png|webp|gif)(?![a-z0-9])[^"]*)"', re.I)
+IMG_URL_RE = re.compile(r'https://[^\s"\'<>]+\.(?:jpeg|jpg|png|webp|gif)(?![a-z0-9])(?:\?[^\s"\'<>]*)?', re.I)
+
+# Mirror that last served a page - tried first on the next lookup
+working_domain = None
+
 # ============ HELPER FUNCTIONS ============
 
 def sanitize_filename(name):
-    name = re.sub(r'[<>:"/\\|?*]', '_', name)
-    name = re.sub(r'\s+', '_', name)
+    name = UNSAFE_CHARS_RE.sub('_', name)
+    name = WHITESPACE_RE.sub('_', name)
     return name[:200]
 
 def natural_sort_key(filename):
     return [int(text) if text.isdigit() else text.lower() 
-            for text in re.split(r'(\d+)', filename)]
+            for text in DIGITS_RE.split(filename)]
+
+def dedupe(items):
+    """Drop repeated items, keeping first-seen order"""
+    seen = set()
+    unique = []
+    for item in items:
+        if item not in seen:
+            seen.add(item)
+            unique.append(item)
+    return unique
 
 def rewrite_image_url(url):
     if not url:
         return url
-    if re.match(r'^(https://k).*\.(png|jpg|jpeg|webp)(\?.*)?$', url, re.I):
+    if REWRITE_RE.match(url):
         return url.replace("https://k", "https://n", 1)
     return url
 
+def is_bato_url(url):
+    """True if the URL's host is a Bato mirror (or a subdomain of one)"""
+    host = urlparse(url.strip()).hostname or ''
+    return host in BATO_DOMAIN_SET or any(host.endswith('.' + d) for d in BATO_DOMAIN_SET)
+
+def domain_candidates(original_host):
+    """Mirror domains to try: the URL's own host, then the last one that worked"""
+    preferred = [d for d in (original_host, working_domain) if d]
+    return list(dict.fromkeys(preferred + ["bato.si", "bato.ing"] + BATO_DOMAINS))
+
 def get_title_chapters(title_url):
     """Scrape all chapters from title page"""
-    for test_domain in ["bato.si", "bato.ing"] + BATO_DOMAINS:
-        current_url = title_url
-        for d in BATO_DOMAINS:
-            if d in current_url:
-                current_url = current_url.replace(d, test_domain)
-                break
+    global working_domain
+    parsed = urlparse(title_url)
+    for test_domain in domain_candidates(parsed.netloc):
+        current_url = parsed._replace(netloc=test_domain).geturl()
         
         try:
-            response = requests.get(current_url, headers=HEADERS, timeout=15)
+            response = SESSION.get(current_url, timeout=15)
             if response.status_code != 200:
                 continue
             
-            soup = BeautifulSoup(response.text, 'html.parser')
+            soup = BeautifulSoup(response.content, 'lxml')
             
             # Get manga title
             title_elem = soup.find('h3', class_='item-title')
@@ -96,7 +199,7 @@ def get_title_chapters(title_url):
             chapter_links = soup.select('a[href*="/chapter/"]')
             
             if not chapter_links:
-                chapter_links = soup.find_all('a', href=re.compile(r'/chapter/\d+'))
+                chapter_links = soup.find_all('a', href=CHAPTER_HREF_RE)
             
             seen_urls = set()
             
@@ -122,12 +225,12 @@ def get_title_chapters(title_url):
                 chapter_text = link.get_text(strip=True)
                 
                 # Try to get chapter number
-                chapter_num_match = re.search(r'(?:Chapter|Ch\.?)\s*(\d+(?:\.\d+)?)', chapter_text, re.I)
+                chapter_num_match = CHAPTER_NUM_RE.search(chapter_text)
                 if chapter_num_match:
                     chapter_num = float(chapter_num_match.group(1))
                 else:
                     # Try to extract number from URL
-                    url_num_match = re.search(r'/chapter/(\d+)', chapter_url)
+                    url_num_match = CHAPTER_URL_NUM_RE.search(chapter_url)
                     chapter_num = float(url_num_match.group(1)) if url_num_match else 0
                 
                 chapters.append({
@@ -139,6 +242,7 @@ def get_title_chapters(title_url):
             if chapters:
                 # Sort by chapter number (descending - newest first)
                 chapters.sort(key=lambda x: x['number'], reverse=True)
+                working_domain = test_domain
                 
                 return {
                     'manga_title': manga_title,
@@ -151,94 +255,408 @@ def get_title_chapters(title_url):
     
     return None
 
-def extract_images_multi_strategy(soup, page_html):
-    image_urls = []
-    scripts = soup.find_all('script')
+def extract_images_multi_strategy(page_html):
+    # The imgHttps array can be pulled straight from the raw HTML in one C-level
+    # scan, without walking every parsed <script> tag
+    match = IMG_HTTPS_RE.search(page_html)
+    if match:
+        try:
+            urls = json.loads(match.group(1))
+        except ValueError:
+            # JS-style quirks (single quotes, trailing commas) are still a
+            # valid Python literal, which beats falling back to the script scan
+            try:
+                urls = ast.literal_eval(match.group(1))
+            except Exception:
+                urls = None
+        if urls and isinstance(urls, list):
+            return urls
     
-    for script in scripts:
-        if not script.string:
-            continue
-        
-        if 'imgHttps' in script.string:
-            match = re.search(r'imgHttps\s*=\s*(\[[^\]]*\])', script.string)
-            if match:
-                try:
-                    urls = json.loads(match.group(1))
-                    if urls:
-                        return urls
-                except:
-                    pass
-        
-        if 'imgHttpLis' in script.string or 'batoPass' in script.string:
-            urls = re.findall(r'"(https://[^"]+\.(?:jpg|jpeg|png|webp|gif)[^"]*)"', script.string, re.I)
+    # Single pass over the inline scripts: return on a Bato image list,
+    # otherwise remember the first script with enough bare image URLs
+    fallback_urls = []
+    for script in SCRIPT_RE.findall(page_html):
+        if 'imgHttpLis' in script or 'batoPass' in script:
+            urls = QUOTED_IMG_URL_RE.findall(script)
             if urls:
                 return urls
+        
+        if not fallback_urls:
+            unique_urls = dedupe(IMG_URL_RE.findall(script))
+            if len(unique_urls) >= 3:
+                fallback_urls = unique_urls
     
-    for script in scripts:
-        if script.string:
-            urls = re.findall(r'https://[^\s"\'<>]+\.(?:jpg|jpeg|png|webp|gif)(?:\?[^\s"\'<>]*)?', 
-                            script.string, re.I)
-            if urls:
-                unique_urls = list(dict.fromkeys(urls))
-                if len(unique_urls) >= 3:
-                    return unique_urls
-    
-    return []
+    return fallback_urls
 
 def get_chapter_info(chapter_url):
-    for test_domain in ["bato.si", "bato.ing"] + BATO_DOMAINS:
-        current_url = chapter_url
-        for d in BATO_DOMAINS:
-            if d in current_url:
-                current_url = current_url.replace(d, test_domain)
-                break
+    try:
+        return fetch_chapter_info(chapter_url)
+    except LookupError:
+        return None
+
+def try_chapter_mirror(parsed, test_domain, timeout=15):
+    """Fetch a chapter from one mirror; None unless the page yields images"""
+    try:
+        response = SESSION.get(parsed._replace(netloc=test_domain).geturl(), timeout=timeout)
+        if response.status_code != 200:
+            return None
         
+        image_urls = extract_images_multi_strategy(response.text)
+        
+        if not image_urls:
+            return None
+        
+        # Only the title candidates are needed, so don't build the whole DOM.
+        # Raw bytes let lxml sniff the encoding itself.
+        soup = BeautifulSoup(response.content, 'lxml', parse_only=CHAPTER_TITLE_TAGS)
+        
+        # A repeated URL is a repeated page - download_chapter_images fetches it once
+        image_urls = [rewrite_image_url(url) for url in image_urls]
+        
+        title_elem = (soup.find('h3', class_='nav-title') or 
+                     soup.find('h1') or 
+                     soup.find('title'))
+        chapter_title = title_elem.get_text(strip=True) if title_elem else "Chapter"
+        
+        return {
+            'title': chapter_title,
+            'images': image_urls,
+            'domain': test_domain
+        }
+    except:
+        return None
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def fetch_chapter_info(chapter_url):
+    """Cached chapter lookup - raises on failure so misses aren't cached"""
+    global working_domain
+    parsed = urlparse(chapter_url)
+    candidates = domain_candidates(parsed.netloc)
+    
+    # Race the likeliest mirrors so a dead one doesn't cost a full timeout.
+    # Candidates are queued in preference order, so each failure frees a
+    # worker for the next mirror and the rest never start once one succeeds.
+    # Not a `with` block - that would wait for the losing requests to finish.
+    executor = ThreadPoolExecutor(max_workers=4)
+    try:
+        pending = {executor.submit(try_chapter_mirror, parsed, d, 8) for d in candidates}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                chapter_info = future.result()
+                if chapter_info:
+                    working_domain = chapter_info['domain']
+                    return chapter_info
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    raise LookupError(f"No mirror returned images for {chapter_url}")
+
+def image_cache_path(url):
+    return os.path.join(IMAGE_CACHE_DIR, hashlib.blake2b(url.encode(), digest_size=16).hexdigest())
+
+def store_in_image_cache(src_path, cache_path):
+    try:
+        os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
+        # Copy then rename so other threads never see a half-written entry
+        tmp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+        shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+
+def prune_image_cache():
+    """Evict least recently used cache entries beyond IMAGE_CACHE_MAX_BYTES"""
+    try:
+        with os.scandir(IMAGE_CACHE_DIR) as it:
+            entries = [(e.stat().st_mtime, e.stat().st_size, e.path) for e in it if e.is_file()]
+    except OSError:
+        return
+    
+    total_bytes = 0
+    for _, size, path in sorted(entries, reverse=True):
+        total_bytes += size
+        if total_bytes > IMAGE_CACHE_MAX_BYTES:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def image_extension(path):
+    """Pick an extension from the file's magic bytes (.jpg if unrecognised)"""
+    with open(path, 'rb') as f:
+        head = f.read(12)
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return '.webp'
+    for signature, ext in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    return '.jpg'
+
+def save_with_real_extension(path):
+    """Rename an extensionless download to match its format; returns the new path"""
+    new_path = path + image_extension(path)
+    os.replace(path, new_path)
+    return new_path
+
+def download_image(url, save_base):
+    """Download to save_base plus the image's real extension; returns the path or None"""
+    cache_path = image_cache_path(url)
+    try:
+        shutil.copyfile(cache_path, save_base)
+        if is_readable_image(save_base):
+            os.utime(cache_path)  # Mark as recently used
+            return save_with_real_extension(save_base)
+        os.remove(cache_path)  # Not an image - refetch instead of replaying it
+    except OSError:
+        pass
+    
+    try:
+        # Stream socket -> disk in 64KB chunks instead of buffering the whole body
+        with SESSION.get(url, stream=True, timeout=15) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            with open(save_base, 'wb') as f:
+                shutil.copyfileobj(response.raw, f, length=64 * 1024)
+        # A 200 can still be an HTML error or challenge page - don't let that
+        # stick to the URL for every later retry
+        if is_readable_image(save_base):
+            store_in_image_cache(save_base, cache_path)
+        return save_with_real_extension(save_base)
+    except:
+        # Don't leave a truncated file behind for the PDF step to choke on
         try:
-            response = requests.get(current_url, headers=HEADERS, timeout=15)
-            if response.status_code != 200:
-                continue
-            
-            soup = BeautifulSoup(response.text, 'html.parser')
-            image_urls = extract_images_multi_strategy(soup, response.text)
-            
-            if not image_urls:
-                continue
-            
-            image_urls = [rewrite_image_url(url) for url in image_urls]
-            
-            title_elem = (soup.find('h3', class_='nav-title') or 
-                         soup.find('h1') or 
-                         soup.find('title'))
-            chapter_title = title_elem.get_text(strip=True) if title_elem else "Chapter"
-            
-            return {
-                'title': chapter_title,
-                'images': image_urls,
-                'domain': test_domain
-            }
+            os.remove(save_base)
+        except OSError:
+            pass
+        return None
+
+def open_image(img_path):
+    """Open an image, decoding JPEGs with libjpeg-turbo (SIMD) when available"""
+    if TURBO_JPEG:
+        with open(img_path, 'rb') as f:
+            data = f.read()
+        if data.startswith(b'\xff\xd8'):
+            try:
+                return Image.fromarray(TURBO_JPEG.decode(data, pixel_format=TJPF_RGB))
+            except Exception:
+                pass
+    return Image.open(img_path)
+
+def convert_to_rgb(img):
+    """Flatten transparency onto white and return an RGB image"""
+    if img.mode == 'P':
+        # Palette images without a transparent index have nothing to flatten
+        if 'transparency' not in img.info:
+            return img.convert('RGB')
+        img = img.convert('RGBA')
+    if img.mode in ('RGBA', 'LA'):
+        # getchannel() pulls just the alpha band instead of splitting them all
+        alpha = img.getchannel('A')
+        # Scans are usually fully opaque - skip the white backdrop when they are
+        if alpha.getextrema()[0] == 255:
+            return img.convert('RGB')
+        rgb_img = Image.new('RGB', img.size, (255, 255, 255))
+        rgb_img.paste(img, mask=alpha)
+        return rgb_img
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+def is_readable_image(img_path):
+    """Cheap header-only check that PIL recognises the file"""
+    try:
+        with Image.open(img_path):
+            return True
+    except:
+        return False
+
+def load_rgb_image(img_path):
+    """Fully decode a page to RGB, or return None if it can't be read"""
+    try:
+        img = convert_to_rgb(open_image(img_path))
+        img.load()
+        return img
+    except:
+        return None
+
+def scaled_height(width, height, target_width):
+    # Never 0 - a thin spacer strip would otherwise break resize and the layout
+    return max(1, int(height * target_width / width))
+
+def prepare_stitch_image(img_path, target_width):
+    """Decode a page to RGB and scale it to target_width"""
+    img = load_rgb_image(img_path)
+    if img and img.width != target_width:
+        new_height = scaled_height(img.width, img.height, target_width)
+        try:
+            # reducing_gap box-shrinks large downscales before LANCZOS runs,
+            # so the expensive kernel only works at <= 2x the target size
+            img = img.resize((target_width, new_height), Image.Resampling.LANCZOS, reducing_gap=2.0)
         except:
-            continue
+            return None
+    return img
+
+def stitch_chunk(chunk, target_width, executor):
+    """Stitch a chunk of pages into one RGB image with PIL"""
+    # Decode + resize across cores - map keeps page order
+    prepared = executor.map(prepare_stitch_image, chunk, [target_width] * len(chunk))
+    images = [img for img in prepared if img]
     
-    return None
+    if not images:
+        return None
+    
+    chunk_height_px = sum(img.height for img in images)
+    stitched = Image.new('RGB', (target_width, chunk_height_px), (255, 255, 255))
+    
+    y_offset = 0
+    for img in images:
+        stitched.paste(img, (0, y_offset))
+        y_offset += img.height
+        img.close()
+    
+    return stitched
 
-def download_image(url, save_path):
+def stitch_chunk_vips(chunk, target_width):
+    """Stitch a chunk with libvips, streaming pages instead of decoding each into PIL"""
     try:
-        response = requests.get(url, headers=HEADERS, timeout=15)
-        response.raise_for_status()
-        with open(save_path, 'wb') as f:
-            f.write(response.content)
-        return True
+        tiles = []
+        for img_path in chunk:
+            tile = pyvips.Image.new_from_file(img_path, access='sequential')
+            target_height = scaled_height(tile.width, tile.height, target_width)
+            if tile.width != target_width:
+                tile = tile.resize(target_width / tile.width, vscale=target_height / tile.height, 
+                                   kernel='lanczos3')
+            if tile.interpretation != 'srgb':
+                tile = tile.colourspace('srgb')
+            if tile.hasalpha():
+                tile = tile.flatten(background=[255, 255, 255])
+            # Absorb resize rounding so pages line up exactly like the PIL path
+            if (tile.width, tile.height) != (target_width, target_height):
+                tile = tile.embed(0, 0, target_width, target_height, extend='white')
+            tiles.append(tile.cast('uchar'))
+        
+        stitched = functools.reduce(lambda top, bottom: top.join(bottom, 'vertical'), tiles)
+        return Image.frombuffer('RGB', (stitched.width, stitched.height), 
+                                stitched.write_to_memory(), 'raw', 'RGB', 0, 1)
+    except Exception:
+        return None  # Let the PIL path handle (and skip) anything vips can't
+
+def has_transparency(img):
+    return img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+
+def normalize_image(img_path):
+    """Rewrite a transparent page as a flattened RGB PNG so PDF assembly can skip it"""
+    try:
+        with Image.open(img_path) as img:
+            # img2pdf embeds RGB, L, CMYK and opaque palette pages as they are
+            if not has_transparency(img):
+                return img_path
+            rgb_img = convert_to_rgb(img)
+        new_path = os.path.splitext(img_path)[0] + '.png'
+        rgb_img.save(new_path, 'PNG', compress_level=1)
+        if new_path != img_path:
+            os.remove(img_path)
+        return new_path
     except:
-        return False
+        return img_path
+
+def show_download_progress(downloaded, total_images, progress_bar=None, status=None):
+    percent = int(100 * downloaded / total_images) if total_images else 100
+    if progress_bar:
+        progress_bar.progress(percent / 100)
+    if status:
+        status.write(f"{downloaded}/{total_images} ({percent}%)")
+
+def download_chapter_images(image_urls, temp_folder, progress_bar=None, status=None, max_workers=12, 
+                            normalize=True):
+    """Download chapter images, normalizing each page as soon as it lands"""
+    total_images = len(image_urls)
+    downloaded = 0
+    # Downloads are pure network I/O, so scale workers with chapter size up to
+    # the user's limit (the SESSION pool must stay at least this large)
+    workers = min(max_workers, max(4, total_images // 8))
+    prune_image_cache()
+    
+    # Conversion runs on its own small pool so PIL work overlaps the downloads
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dl") as executor, \
+            ThreadPoolExecutor(max_workers=2) as converter:
+        # Pages that repeat an image share one download, copied to each page
+        pages_by_url = {}
+        for idx, img_url in enumerate(image_urls, 1):
+            save_base = os.path.join(temp_folder, f"page_{idx:04d}")
+            pages_by_url.setdefault(img_url, []).append(save_base)
+        futures = {executor.submit(download_image, img_url, save_bases[0]): save_bases[1:]
+                   for img_url, save_bases in pages_by_url.items()}
+        
+        last_update = 0.0
+        for future in as_completed(futures):
+            repeat_bases = futures.pop(future)  # Release each future as soon as it's handled
+            save_path = future.result()
+            if not save_path:
+                continue
+            ext = os.path.splitext(save_path)[1]
+            page_paths = [save_path]
+            for save_base in repeat_bases:
+                shutil.copyfile(save_path, save_base + ext)
+                page_paths.append(save_base + ext)
+            if normalize:
+                for page_path in page_paths:
+                    converter.submit(normalize_image, page_path)
+            downloaded += len(page_paths)
+            now = time.monotonic()
+            if now - last_update >= PROGRESS_INTERVAL:
+                last_update = now
+                show_download_progress(downloaded, total_images, progress_bar, status)
+    
+    # Always paint the final count, whatever the throttle skipped
+    show_download_progress(downloaded, total_images, progress_bar, status)
+    return downloaded
+
+def pdf_page_layout(imgwidthpx, imgheightpx, ndpi):
+    """img2pdf layout at a fixed 300 DPI, padding pages to the 3pt minimum it accepts"""
+    pagewidth, pageheight, imgwidth, imgheight = img2pdf.default_layout_fun(
+        imgwidthpx, imgheightpx, (300, 300))
+    # A thin spacer strip (e.g. 800x5) would otherwise fail the whole chapter
+    return max(pagewidth, 3), max(pageheight, 3), imgwidth, imgheight
+
+def img2pdf_source(img_path, reencode_dir):
+    """Path img2pdf should embed for a page, or None if the page is unreadable"""
+    try:
+        with Image.open(img_path) as img:
+            # JPEG and PNG streams are copied into the PDF as they are
+            if img.format in ('JPEG', 'PNG'):
+                return img_path
+    except:
+        return None
+    
+    # img2pdf would store anything else (WebP, GIF) as raw Flate pixels, so
+    # re-encode it once the way the PIL path writes pages
+    img = load_rgb_image(img_path)
+    if img is None:
+        return None
+    jpeg_path = os.path.join(reencode_dir, os.path.basename(img_path) + '.jpg')
+    try:
+        img.save(jpeg_path, 'JPEG', quality=100)
+    except:
+        return None
+    finally:
+        img.close()
+    return jpeg_path
 
 def images_to_pdf_lossless(image_folder, output_pdf_path, chunk_height=0, progress_bar=None):
     """Convert images to PDF with LOSSLESS quality"""
-    image_files = []
-    for fname in os.listdir(image_folder):
-        if fname.lower().endswith(('.png', '.jpg', '.jpeg', '.webp', '.gif')):
-            image_files.append(os.path.join(image_folder, fname))
+    with os.scandir(image_folder) as it:
+        entries = [e for e in it 
+                   if e.is_file() and e.name.rpartition('.')[2].lower() in IMAGE_EXTS]
     
-    image_files.sort(key=lambda x: natural_sort_key(os.path.basename(x)))
+    # Our own page_0001.jpg names are zero-padded, so a plain sort is already
+    # in page order - only fall back to natural sort for anything else
+    if all(PAGE_FILE_RE.fullmatch(e.name) for e in entries):
+        entries.sort(key=lambda e: e.name)
+    else:
+        entries.sort(key=lambda e: natural_sort_key(e.name))
+    image_files = [e.path for e in entries]
     
     if not image_files:
         return False
@@ -250,142 +668,147 @@ def images_to_pdf_lossless(image_folder, output_pdf_path, chunk_height=0, progre
         if progress_bar:
             progress_bar.progress(10, text=f"Processing {total_images} images...")
         
+        # Fast path: embed the downloaded JPEG/PNG streams directly, no decode/re-encode.
+        # Unreadable pages are skipped (as the PIL path does) so one broken
+        # download doesn't push the whole chapter onto the slow path
+        if img2pdf:
+            with tempfile.TemporaryDirectory() as reencode_dir, \
+                    ThreadPoolExecutor(max_workers=os.cpu_count() or 4) as executor:
+                sources = executor.map(img2pdf_source, image_files, [reencode_dir] * total_images)
+                pdf_files = [p for p in sources if p]
+                if pdf_files:
+                    try:
+                        with open(output_pdf_path, 'wb') as f:
+                            # One page per file, as the PIL path writes - not one per frame
+                            img2pdf.convert(pdf_files, outputstream=f, first_frame_only=True,
+                                            layout_fun=pdf_page_layout)
+                        if progress_bar:
+                            progress_bar.progress(100, text=f"✅ Complete! ({len(pdf_files)} pages)")
+                        return True
+                    except:
+                        pass  # Fall back to PIL below
+        
         batch_size = 50
-        all_pdf_images = []
+        pages_written = 0
         
-        for batch_start in range(0, len(image_files), batch_size):
-            batch_end = min(batch_start + batch_size, len(image_files))
-            batch_files = image_files[batch_start:batch_end]
-            
-            if progress_bar:
-                progress = int(10 + 80 * batch_end / len(image_files))
-                progress_bar.progress(progress, text=f"Converting {batch_start+1}-{batch_end}/{len(image_files)}...")
-            
-            for img_path in batch_files:
+        # Decoding releases the GIL, so spread each batch across cores
+        with ThreadPoolExecutor(max_workers=os.cpu_count() or 4) as executor:
+            for batch_start in range(0, len(image_files), batch_size):
+                batch_end = min(batch_start + batch_size, len(image_files))
+                batch_files = image_files[batch_start:batch_end]
+                
+                if progress_bar:
+                    progress = int(10 + 80 * batch_end / len(image_files))
+                    progress_bar.progress(progress, text=f"Converting {batch_start+1}-{batch_end}/{len(image_files)}...")
+                
+                batch_images = [img for img in executor.map(load_rgb_image, batch_files) if img]
+                
+                if not batch_images:
+                    continue
+                
+                # Append each batch to the PDF as soon as it's converted so only one
+                # batch of decoded pages is ever held in memory
                 try:
-                    img = Image.open(img_path)
-                    if img.mode in ('RGBA', 'LA', 'P'):
-                        rgb_img = Image.new('RGB', img.size, (255, 255, 255))
-                        if img.mode == 'P':
-                            img = img.convert('RGBA')
-                        rgb_img.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-                        img = rgb_img
-                    elif img.mode != 'RGB':
-                        img = img.convert('RGB')
-                    all_pdf_images.append(img)
+                    batch_images[0].save(output_pdf_path, 'PDF', resolution=300.0, save_all=True, 
+                                         append=pages_written > 0, append_images=batch_images[1:], 
+                                         quality=100, optimize=False, compress_level=0)
                 except:
-                    continue
+                    return False
+                finally:
+                    for img in batch_images:
+                        img.close()
+                
+                pages_written += len(batch_images)
         
-        if not all_pdf_images:
+        if not pages_written:
             return False
         
         if progress_bar:
-            progress_bar.progress(95, text=f"Saving ({len(all_pdf_images)} pages)...")
-        
-        try:
-            first_image = all_pdf_images[0]
-            other_images = all_pdf_images[1:] if len(all_pdf_images) > 1 else []
-            first_image.save(output_pdf_path, 'PDF', resolution=300.0, save_all=True, 
-                           append_images=other_images, quality=100, optimize=False, compress_level=0)
-            if progress_bar:
-                progress_bar.progress(100, text="✅ Complete!")
-            return True
-        except:
-            return False
+            progress_bar.progress(100, text=f"✅ Complete! ({pages_written} pages)")
+        return True
     
     # STITCHING MODE (simplified for brevity - same as v2.1)
     else:
         if progress_bar:
             progress_bar.progress(10, text="Loading images...")
         
-        images = []
-        min_width = None
-        
-        for idx, img_path in enumerate(image_files):
-            if progress_bar and idx % 10 == 0:
-                progress = int(10 + 40 * (idx + 1) / total_images)
-                progress_bar.progress(progress, text=f"Loading {idx+1}/{total_images}...")
-            
+        # Page sizes come from the image headers (no pixel decode), so every page
+        # is scaled to the true minimum width and chunks can be laid out up front
+        sizes = []
+        for img_path in image_files:
             try:
-                img = Image.open(img_path)
-                if min_width is None or img.width < min_width:
-                    min_width = img.width
-                
-                if img.mode in ('RGBA', 'LA', 'P'):
-                    rgb_img = Image.new('RGB', img.size, (255, 255, 255))
-                    if img.mode == 'P':
-                        img = img.convert('RGBA')
-                    rgb_img.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-                    img = rgb_img
-                elif img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                if min_width and img.width != min_width:
-                    ratio = min_width / img.width
-                    new_height = int(img.height * ratio)
-                    img = img.resize((min_width, new_height), Image.Resampling.LANCZOS)
-                
-                images.append(img)
+                with Image.open(img_path) as img:
+                    sizes.append((img_path, img.width, img.height))
             except:
                 continue
         
-        if not images:
+        if not sizes:
             return False
         
+        min_width = min(width for _, width, _ in sizes)
+        
         if progress_bar:
-            progress_bar.progress(55, text="Creating chunks...")
+            progress_bar.progress(15, text="Creating chunks...")
         
         chunks = []
         current_chunk = []
         current_height = 0
         
-        for img in images:
-            if current_height + img.height > chunk_height and current_chunk:
+        for img_path, width, height in sizes:
+            height = scaled_height(width, height, min_width)
+            if current_height + height > chunk_height and current_chunk:
                 chunks.append(current_chunk)
-                current_chunk = [img]
-                current_height = img.height
+                current_chunk = [img_path]
+                current_height = height
             else:
-                current_chunk.append(img)
-                current_height += img.height
+                current_chunk.append(img_path)
+                current_height += height
         
         if current_chunk:
             chunks.append(current_chunk)
         
-        if progress_bar:
-            progress_bar.progress(60, text=f"Stitching {len(chunks)} chunks...")
+        pages_written = 0
+        
+        def build_chunk(chunk):
+            stitched = stitch_chunk_vips(chunk, min_width) if pyvips else None
+            if stitched is None:
+                stitched = stitch_chunk(chunk, min_width, executor)
+            return stitched
+        
+        # The next chunk is stitched on its own thread while the current one is
+        # JPEG-encoded into the PDF (both release the GIL), so at most two
+        # chunks of decoded pages are held in memory at once
+        with ThreadPoolExecutor(max_workers=os.cpu_count() or 4) as executor, \
+                ThreadPoolExecutor(max_workers=1) as stitcher:
+            next_stitched = stitcher.submit(build_chunk, chunks[0])
+            for chunk_idx in range(len(chunks)):
+                if progress_bar:
+                    progress = int(15 + 80 * (chunk_idx + 1) / len(chunks))
+                    progress_bar.progress(progress, text=f"Stitching {chunk_idx+1}/{len(chunks)}...")
+                
+                stitched = next_stitched.result()
+                if chunk_idx + 1 < len(chunks):
+                    next_stitched = stitcher.submit(build_chunk, chunks[chunk_idx + 1])
+                if stitched is None:
+                    continue
+                
+                try:
+                    stitched.save(output_pdf_path, 'PDF', resolution=300.0, append=pages_written > 0, 
+                                  quality=100, optimize=False, compress_level=0)
+                except:
+                    next_stitched.cancel()
+                    return False
+                finally:
+                    stitched.close()
+                
+                pages_written += 1
         
-        stitched_images = []
-        for chunk_idx, chunk in enumerate(chunks):
-            if progress_bar:
-                progress = int(60 + 30 * (chunk_idx + 1) / len(chunks))
-                progress_bar.progress(progress, text=f"Stitching {chunk_idx+1}/{len(chunks)}...")
-            
-            chunk_height_px = sum(img.height for img in chunk)
-            stitched = Image.new('RGB', (min_width, chunk_height_px), (255, 255, 255))
-            
-            y_offset = 0
-            for img in chunk:
-                stitched.paste(img, (0, y_offset))
-                y_offset += img.height
-            
-            stitched_images.append(stitched)
+        if not pages_written:
+            return False
         
         if progress_bar:
-            progress_bar.progress(95, text=f"Saving ({len(stitched_images)} pages)...")
-        
-        if stitched_images:
-            try:
-                first_image = stitched_images[0]
-                other_images = stitched_images[1:] if len(stitched_images) > 1 else []
-                first_image.save(output_pdf_path, 'PDF', resolution=300.0, save_all=True, 
-                               append_images=other_images, quality=100, optimize=False, compress_level=0)
-                if progress_bar:
-                    progress_bar.progress(100, text="✅ Complete!")
-                return True
-            except:
-                return False
-        
-        return False
+            progress_bar.progress(100, text=f"✅ Complete! ({pages_written} pages)")
+        return True
 
 def parse_urls(text):
     """Parse multiple URLs from text"""
@@ -393,12 +816,42 @@ def parse_urls(text):
     urls = []
     for line in lines:
         line = line.strip()
-        if line and any(domain in line for domain in BATO_DOMAINS):
+        if line and is_bato_url(line):
             urls.append(line)
     return urls
 
 # ============ STREAMLIT UI ============
 
+def run_in_background(label, func, *args):
+    """Run a blocking call on a worker thread while the page shows elapsed time"""
+    outcome = {}
+    
+    def worker():
+        try:
+            outcome['result'] = func(*args)
+        except Exception as e:
+            outcome['error'] = e
+    
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    
+    # Keep touching the page while waiting so Streamlit can repaint and
+    # honour reruns instead of sitting frozen inside a network call
+    status = st.empty()
+    start_time = time.time()
+    shown = -1
+    while thread.is_alive():
+        thread.join(0.25)
+        elapsed = int(time.time() - start_time)
+        if elapsed != shown:
+            status.caption(f"{label} {elapsed}s")
+            shown = elapsed
+    status.empty()
+    
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome.get('result')
+
 def main():
     # Initialize session state
     if 'downloads' not in st.session_state:
@@ -407,6 +860,8 @@ def main():
         st.session_state.stitch_mode = 'skip'
     if 'custom_height' not in st.session_state:
         st.session_state.custom_height = 10000
+    if 'download_workers' not in st.session_state:
+        st.session_state.download_workers = 12
     if 'download_mode' not in st.session_state:
         st.session_state.download_mode = 'single'
     if 'fetched_chapters' not in st.session_state:
@@ -482,6 +937,19 @@ def main():
         
         st.divider()
         
+        # Download threads
+        st.subheader("⚡ Download Speed")
+        download_workers = st.slider(
+            "Max parallel downloads:",
+            min_value=4,
+            max_value=24,
+            value=st.session_state.download_workers,
+            help="Small chapters use fewer threads automatically"
+        )
+        st.session_state.download_workers = download_workers
+        
+        st.divider()
+        
         # Current settings
         st.markdown("**📊 Current:**")
         if chunk_height == 0:
@@ -530,11 +998,11 @@ def main():
     
     # Render based on mode
     if st.session_state.download_mode == 'single':
-        render_single_mode(chunk_height)
+        render_single_mode(chunk_height, download_workers)
     elif st.session_state.download_mode == 'smart':
-        render_smart_mode(chunk_height)
+        render_smart_mode(chunk_height, download_workers)
     else:  # bulk
-        render_bulk_mode(chunk_height)
+        render_bulk_mode(chunk_height, download_workers)
     
     # Mode banner
     if chunk_height == 0:
@@ -552,7 +1020,7 @@ def main():
     </div>
     """, unsafe_allow_html=True)
 
-def render_single_mode(chunk_height):
+def render_single_mode(chunk_height, download_workers):
     """Render single chapter download UI"""
     col1, col2 = st.columns([3, 1])
     
@@ -568,9 +1036,9 @@ def render_single_mode(chunk_height):
         download_button = st.button("⬇️ Download", type="primary", use_container_width=True)
     
     if download_button and chapter_url:
-        process_single_download(chapter_url, chunk_height)
+        process_single_download(chapter_url, chunk_height, download_workers)
 
-def render_smart_mode(chunk_height):
+def render_smart_mode(chunk_height, download_workers):
     """Render smart chapter selector UI"""
     st.subheader("🎯 Smart Chapter Selector")
     
@@ -595,14 +1063,14 @@ def render_smart_mode(chunk_height):
     
     # Fetch chapters
     if fetch_button and title_url:
-        is_title_url = any(f'/title/' in title_url for domain in BATO_DOMAINS if domain in title_url)
+        is_title_url = is_bato_url(title_url) and '/title/' in title_url
         
         if not is_title_url:
             st.error("❌ This doesn't look like a title URL! Make sure it contains '/title/'")
             return
         
         with st.spinner("🔍 Fetching chapters from title page..."):
-            title_data = get_title_chapters(title_url)
+            title_data = run_in_background("⏱️", get_title_chapters, title_url)
         
         if not title_data:
             st.error("❌ Failed to fetch chapters! Check if URL is valid.")
@@ -675,11 +1143,11 @@ def render_smart_mode(chunk_height):
                 )
             
             if download_selected:
-                process_bulk_download(st.session_state.selected_chapters, chunk_height)
+                process_bulk_download(st.session_state.selected_chapters, chunk_height, download_workers)
         else:
             st.warning("⚠️ No chapters selected!")
 
-def render_bulk_mode(chunk_height):
+def render_bulk_mode(chunk_height, download_workers):
     """Render bulk download UI"""
     st.subheader("📦 Bulk Download Mode")
     
@@ -702,13 +1170,11 @@ def render_bulk_mode(chunk_height):
             return
         
         st.success(f"✅ Found {len(urls)} URLs to download")
-        process_bulk_download(urls, chunk_height)
+        process_bulk_download(urls, chunk_height, download_workers)
 
-def process_single_download(chapter_url, chunk_height):
+def process_single_download(chapter_url, chunk_height, download_workers=12):
     """Process single chapter download"""
-    is_bato_url = any(domain in chapter_url for domain in BATO_DOMAINS)
-    
-    if not is_bato_url:
+    if not is_bato_url(chapter_url):
         st.error("❌ Not a valid Bato URL!")
         return
     
@@ -716,7 +1182,7 @@ def process_single_download(chapter_url, chunk_height):
     
     try:
         with st.spinner("🔍 Fetching chapter..."):
-            chapter_info = get_chapter_info(chapter_url)
+            chapter_info = run_in_background("⏱️", get_chapter_info, chapter_url)
         
         if not chapter_info:
             st.error("❌ Failed to fetch chapter!")
@@ -736,23 +1202,12 @@ def process_single_download(chapter_url, chunk_height):
         temp_folder = os.path.join(temp_dir, chapter_title)
         os.makedirs(temp_folder, exist_ok=True)
         
-        downloaded = 0
         start_time = time.time()
         
-        with ThreadPoolExecutor(max_workers=6) as executor:
-            futures = []
-            for idx, img_url in enumerate(chapter_info['images'], 1):
-                save_path = os.path.join(temp_folder, f"page_{idx:04d}.jpg")
-                future = executor.submit(download_image, img_url, save_path)
-                futures.append(future)
-            
-            for future in futures:
-                if future.result():
-                    downloaded += 1
-                    percent = int(100 * downloaded / total_images)
-                    if downloaded % 5 == 0 or downloaded == total_images:
-                        download_progress.progress(percent / 100)
-                        download_status.write(f"{downloaded}/{total_images} ({percent}%)")
+        # Stitch mode decodes every page itself, so only skip mode normalizes
+        downloaded = download_chapter_images(chapter_info['images'], temp_folder, 
+                                             download_progress, download_status, download_workers, 
+                                             normalize=chunk_height == 0)
         
         if downloaded == 0:
             st.error("❌ Failed to download images!")
@@ -802,7 +1257,7 @@ def process_single_download(chapter_url, chunk_height):
         except:
             pass
 
-def process_bulk_download(urls, chunk_height):
+def process_bulk_download(urls, chunk_height, download_workers=12):
     """Process bulk download"""
     temp_dir = tempfile.mkdtemp()
     pdf_files = []
@@ -824,7 +1279,7 @@ def process_bulk_download(urls, chunk_height):
                 
                 try:
                     with st.spinner("Fetching..."):
-                        chapter_info = get_chapter_info(url)
+                        chapter_info = run_in_background("⏱️", get_chapter_info, url)
                     
                     if not chapter_info:
                         st.error(f"❌ Failed")
@@ -841,22 +1296,10 @@ def process_bulk_download(urls, chunk_height):
                     temp_folder = os.path.join(temp_dir, f"chapter_{idx}_{chapter_title}")
                     os.makedirs(temp_folder, exist_ok=True)
                     
-                    downloaded = 0
-                    
-                    with ThreadPoolExecutor(max_workers=6) as executor:
-                        futures = []
-                        for img_idx, img_url in enumerate(chapter_info['images'], 1):
-                            save_path = os.path.join(temp_folder, f"page_{img_idx:04d}.jpg")
-                            future = executor.submit(download_image, img_url, save_path)
-                            futures.append(future)
-                        
-                        for future in futures:
-                            if future.result():
-                                downloaded += 1
-                                percent = int(100 * downloaded / total_images)
-                                if downloaded % 5 == 0 or downloaded == total_images:
-                                    download_progress.progress(percent / 100)
-                                    download_status.write(f"Downloaded: {downloaded}/{total_images}")
+                    downloaded = download_chapter_images(chapter_info['images'], temp_folder, 
+                                                         download_progress, download_status, 
+                                                         download_workers, 
+                                                         normalize=chunk_height == 0)
                     
                     if downloaded == 0:
                         st.error(f"❌ No images")
@@ -887,7 +1330,9 @@ def process_bulk_download(urls, chunk_height):
             with st.spinner("Creating ZIP..."):
                 zip_path = os.path.join(temp_dir, "Bato_Download.zip")
                 
-                with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                # PDFs are already JPEG-compressed - deflating them again burns
+                # CPU for next to no size reduction
+                with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED) as zipf:
                     for pdf_path, title in pdf_files:
                         zipf.write(pdf_path, f"{title}.pdf")
             